@@ -1,26 +1,50 @@
-import bcrypt
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+
+# Mismos parámetros que usa main.py para verificar (argon2id).
+# argon2 genera una sal (salt) aleatoria nueva en cada hash: dos contraseñas
+# iguales tienen hashes diferentes.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 
-# La sal (salt) es un valor aleatorio que asegura que dos contraseñas iguales tengan hashes diferentes
 def generar_hash(password):
     # Genera la sal y hashea la contraseña
-    # bcrypt.gensalt() se asegura de usar una sal nueva cada vez.
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    return hashed.decode('utf-8')
+    return password_hasher.hash(password)
+
+def generar_hashes(passwords: list[str]) -> list[str]:
+    """
+    Hashea varias contraseñas de una vez (ej: para dar de alta a muchos empleados).
+    Los hashes se calculan en paralelo: argon2 libera el GIL, así que cada
+    hilo usa un núcleo.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(password_hasher.hash, passwords))
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Error: Debes pasar una contraseña como argumento.")
         print("Ejemplo: python crear_hash.py mi_password_secreta")
+        print("Varias:  python crear_hash.py pass_guardia1 pass_guardia2 ...")
         sys.exit(1)
 
+    if len(sys.argv) > 2:
+        passwords = sys.argv[1:]
+        print("\n----------------------------------------------------------------------")
+        print("¡COPIA CADA HASH COMPLETO y pégalo en tu tabla 'empleados' de PostgreSQL!")
+        for password, hash_generado in zip(passwords, generar_hashes(passwords)):
+            print(f"{password}: {hash_generado}")
+        print("----------------------------------------------------------------------\n")
+        sys.exit(0)
+
     password_a_hashear = sys.argv[1]
-    
+
     hash_generado = generar_hash(password_a_hashear)
-    
+
     print("\n----------------------------------------------------------------------")
     print(f"Contraseña Original: {password_a_hashear}")
     print("----------------------------------------------------------------------")
     print("¡COPIA ESTE HASH COMPLETO y pégalo en tu tabla 'empleados' de PostgreSQL!")
     print(f"HASH GENERADO: {hash_generado}")
-    print("----------------------------------------------------------------------\n")
\ No newline at end of file
+    print("----------------------------------------------------------------------\n")
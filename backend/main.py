@@ -10,29 +10,57 @@ el proceso de dos pasos para el registro de incidencias:
 Tecnologías usadas:
 - FastAPI: Framework web asíncrono para Python, ideal para APIs rápidas.
 - asyncpg: Conector asíncrono para PostgreSQL, muy eficiente.
-- bcrypt: Librería para encriptar y verificar contraseñas de forma segura.
+- argon2-cffi: Librería para encriptar y verificar contraseñas (argon2id).
+- bcrypt: Para seguir verificando los hashes antiguos mientras se migran.
 - dotenv: Para cargar variables de entorno desde un archivo .env.
 
 Instrucciones para ejecutar el servidor:
-1. Asegúrate de tener Python 3.8+ instalado.
+1. Asegúrate de tener Python 3.10+ instalado (lo pide FastAPI 0.143+).
 2. Instala las dependencias: pip install -r requirements.txt
-3. Configura el archivo .env con la URL de tu base de datos PostgreSQL.
-4. Ejecuta el servidor con: uvicorn main:app --reload --host
+3. Configura el archivo .env con la URL de tu base de datos PostgreSQL
+   (DATABASE_URL) y un secreto para firmar tokens (TOKEN_SECRET).
+   Opcional: DB_POOL_MIN y DB_POOL_MAX (por defecto 5 y 40).
+4. Ejecuta el servidor con: uvicorn main:app --reload --host 0.0.0.0 --port 8000
+   (en producción ver el comando con uvloop/httptools al final del archivo)
 
 """
 
 # --- 1. Importaciones de Librerías ---
 import os  # Para leer variables de entorno (el .env)
-import bcrypt  # Para encriptar y verificar contraseñas (hashes)
+import asyncio  # Para verificar contraseñas fuera del event loop
+import hmac  # Comparación en tiempo constante
+import logging  # Mensajes del servidor (en lugar de print)
+import logging.handlers
+import queue
+import secrets  # Para generar un secreto temporal si falta TOKEN_SECRET
+import time
+from concurrent.futures import ThreadPoolExecutor  # Hilos dedicados para verificar contraseñas
+import bcrypt  # Para verificar los hashes antiguos ($2b$...)
+from argon2 import PasswordHasher  # Para encriptar y verificar contraseñas (argon2id)
+from argon2.exceptions import VerificationError, InvalidHashError
 import asyncpg  # Conector asíncrono para PostgreSQL (muy rápido)
-from fastapi import FastAPI, HTTPException, Request, Depends
-from pydantic import BaseModel  # Para validar los datos JSON que envía Flutter
+import jwt  # PyJWT: tokens firmados (HMAC) entre la consulta y el reporte
+from fastapi import FastAPI, HTTPException, Request, Depends, Response
+from pydantic import BaseModel, field_validator  # Para validar los datos JSON que envía Flutter
 from dotenv import load_dotenv  # Para cargar el archivo .env
 from fastapi.middleware.cors import CORSMiddleware  # Para permitir la conexión desde Flutter
 
 # Carga el archivo .env (que contiene la URL de la base de datos)
 load_dotenv()
 
+# --- Logging ---
+# 'print()' escribe en la consola dentro del event loop y lo bloquea mientras
+# escribe. Con QueueHandler los endpoints solo meten el mensaje en una cola
+# y un hilo aparte (QueueListener) es el que lo escribe en la consola.
+# El hilo se arranca en 'startup_db_client' y se detiene en 'shutdown_db_client'.
+_cola_logs = queue.Queue(-1)
+_listener_logs = logging.handlers.QueueListener(_cola_logs, logging.StreamHandler())
+
+log = logging.getLogger("sivc")
+log.setLevel(logging.INFO)
+log.addHandler(logging.handlers.QueueHandler(_cola_logs))
+log.propagate = False
+
 # --- 2. Configuración de la Aplicación FastAPI ---
 app = FastAPI(
     title="Servidor SIVC (Tec Culiacán)",
@@ -58,7 +86,7 @@ app.add_middleware(
 class LoginRequest(BaseModel):
     """Define la estructura esperada para el JSON de /login"""
     numero_empleado: str
-    password: str
+    password: bytes  # Pydantic la entrega ya en bytes (utf-8), lista para verificar
 
 class IncidenciaRequest(BaseModel):
     """Define la estructura esperada para el JSON de /reportar"""
@@ -66,9 +94,215 @@ class IncidenciaRequest(BaseModel):
     latitud: float
     longitud: float
     id_empleado: str  # Este es el 'numero_empleado' (Ej: g1)
+    token: str | None = None  # El 'token' que devolvió /vehiculo/{placa}
+
+    @field_validator('placa')
+    @classmethod
+    def _normalizar_placa(cls, v: str) -> str:
+        """Limpia la placa al recibir el JSON, una sola vez (ver normalizar_placa)."""
+        return normalizar_placa(v)
+
+# Modelos de las respuestas. Con 'response_model' FastAPI convierte lo que
+# devuelve cada endpoint a JSON directamente con Pydantic (en Rust), que es
+# más rápido que pasar por json.dumps.
+# Los campos que salen de columnas de la BD que pueden ser NULL son opcionales
+# (como antes, se devuelven como null en lugar de fallar con un 500).
+
+class MensajeResponse(BaseModel):
+    """Respuesta de "/" y de /reportar"""
+    mensaje: str
+
+class LoginResponse(BaseModel):
+    """Respuesta de /login cuando los datos son correctos"""
+    mensaje: str
+    nombre: str | None = None
+    numero_empleado: str  # Es el mismo que se buscó en el WHERE, nunca NULL
+
+class VehiculoResponse(BaseModel):
+    """Respuesta de /vehiculo/{placa}"""
+    placa: str  # Se encontró por 'placa_norm', que sale de esta columna
+    modelo: str | None = None
+    estado: str | None = None
+    nombre_conductor: str | None = None
+    faltas_actuales: int  # 'n_incidencias' es NOT NULL (migración 002)
+    token: str  # Se manda de regreso en /reportar
+
+# --- Token de Consulta ---
+# /vehiculo/{placa} (PASO 1) devuelve un token firmado con los datos del
+# vehículo que ya buscó. /reportar (PASO 2) solo comprueba la firma y no
+# tiene que volver a hacer el JOIN en la BD. El token caduca a los 5 min.
+# TOKEN_SECRET debe ser igual en todos los procesos del servidor; si no está
+# en el .env se usa uno aleatorio (solo sirve con un proceso y se pierde al
+# reiniciar; en ese caso /reportar simplemente vuelve a consultar la BD).
+TOKEN_SECRET = os.environ.get("TOKEN_SECRET") or secrets.token_hex(32)
+TOKEN_DURACION = 300  # segundos
+
+def crear_token_vehiculo(vehiculo: dict, placa_limpia: str) -> str:
+    """Firma los datos que /reportar necesita del vehículo (HS256)."""
+    return jwt.encode(
+        {
+            "placa": vehiculo['placa'],
+            "placa_norm": placa_limpia,
+            "estado": vehiculo['estado'],
+            "nombre_conductor": vehiculo['nombre_conductor'],
+            "exp": int(time.time()) + TOKEN_DURACION,
+        },
+        TOKEN_SECRET,
+        algorithm="HS256"
+    )
+
+def leer_token_vehiculo(token: str | None, placa_limpia: str) -> dict | None:
+    """
+    Devuelve los datos del token si la firma es válida, no ha caducado y es
+    de la misma placa que se reporta. Si no, devuelve None.
+    """
+    if not token:
+        return None
+    try:
+        datos = jwt.decode(token, TOKEN_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        log.warning("Token de vehículo inválido o caducado; se consulta la BD.")
+        return None
+    if datos.get("placa_norm") != placa_limpia:
+        return None
+    return datos
+
+# Tabla para str.translate: quita '-' y ' ' y pasa a-z a mayúsculas en una
+# sola pasada (en vez de crear 3 cadenas con .upper().replace().replace()).
+# Las placas solo usan letras A-Z y números.
+_TABLA_PLACA = str.maketrans({
+    '-': None,
+    ' ': None,
+    **{chr(c): chr(c - 32) for c in range(ord('a'), ord('z') + 1)}
+})
+
+def normalizar_placa(placa: str) -> str:
+    """
+    Limpia una placa igual que la columna 'placa_norm' de la BD:
+    mayúsculas y sin guiones ni espacios (ej: 'vjm-131 c' -> 'VJM131C').
+    """
+    return placa.translate(_TABLA_PLACA)
+
+# --- Verificación de Contraseñas ---
+# Los hashes nuevos son argon2id (ver crear_hash.py): a igual seguridad
+# cuesta menos CPU por login que bcrypt con costo 12. Los hashes bcrypt
+# que ya están en la BD siguen funcionando mientras se regeneran.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def verificar_password(password_bytes: bytes, hash_bytes: bytes) -> bool:
+    """
+    Compara la contraseña con el hash guardado, usando el algoritmo que
+    indica el prefijo del hash ('$argon2id$...' o '$2b$...' de bcrypt).
+    Es trabajo pesado de CPU: se llama desde el pool de hilos.
+    """
+    if hash_bytes.startswith(b"$argon2"):
+        try:
+            return password_hasher.verify(hash_bytes, password_bytes)
+        except (VerificationError, InvalidHashError):
+            return False
+    try:
+        return bcrypt.checkpw(password_bytes, hash_bytes)
+    except ValueError:
+        # bcrypt rechaza contraseñas de más de 72 bytes: es un 401 como
+        # cualquier otra contraseña incorrecta (no un 500)
+        return False
 
 # --- 5. Manejo de la Conexión a la Base de Datos (PostgreSQL) ---
 
+# Consultas SQL de los endpoints. Se definen una sola vez aquí: asyncpg
+# guarda por conexión una caché de sentencias preparadas (statement_cache_size)
+# indexada por el texto SQL, así cada consulta se parsea y planea una sola
+# vez por conexión y después solo se ejecuta el plan ya compilado.
+
+# Solo las columnas que usa /login (nada de SELECT *).
+# 'password_hash' es 'text' en la BD; convert_to() lo devuelve como 'bytea'
+# y asyncpg lo entrega directo como bytes, sin tener que hacer .encode().
+SQL_LOGIN = """
+    SELECT convert_to(password_hash, 'UTF8') AS password_hash_bytes,
+           nombre_completo, numero_empleado
+    FROM empleados
+    WHERE numero_empleado = $1
+"""
+
+# 'n_incidencias' es el contador de faltas del vehículo
+# (ver migraciones/002_n_incidencias.sql), así no hace falta un COUNT(*).
+SQL_VEHICULO = """
+    SELECT v.placa, v.modelo, v.estado, v.n_incidencias, c.nombre_completo
+    FROM vehiculos v
+    JOIN conductores c ON v.id_conductor = c.id_conductor
+    WHERE v.placa_norm = $1
+"""
+
+# Solo se usa si /reportar no recibe un token válido de /vehiculo.
+# El ID del empleado ya no se busca aquí: está en 'app.state.empleado_ids'.
+SQL_VEHICULO_REPORTE = """
+    SELECT v.placa, v.estado, c.nombre_completo, c.telefono
+    FROM vehiculos v
+    JOIN conductores c ON v.id_conductor = c.id_conductor
+    WHERE v.placa_norm = $1
+"""
+
+SQL_ID_EMPLEADO = "SELECT id_empleado FROM empleados WHERE numero_empleado = $1"
+
+SQL_IDS_EMPLEADOS = "SELECT numero_empleado, id_empleado FROM empleados"
+
+# ¿La mayoría de los hashes de la BD ya son argon2? (elige el hash falso de /login)
+SQL_MAYORIA_ARGON2 = """
+    SELECT COUNT(*) FILTER (WHERE password_hash LIKE '$argon2%') * 2 > COUNT(*)
+    FROM empleados
+"""
+
+# INSERT + conteo + bloqueo en una sola sentencia (un solo viaje a la BD).
+# El UPDATE suma 1 al contador del vehículo y, si llega a 3, lo bloquea;
+# RETURNING devuelve el contador ya actualizado (incluye la nueva falta).
+# Además bloquea la fila del vehículo, así dos reportes simultáneos de la
+# misma placa no pueden leer el mismo conteo.
+# El UPDATE solo toca vehículos que NO están bloqueados y el INSERT sale de
+# su RETURNING: si el vehículo ya estaba BLOQUEADO (aunque el token diga
+# otra cosa) no se registra nada y la consulta no devuelve filas.
+SQL_REGISTRAR_INCIDENCIA = """
+    WITH upd AS (
+        UPDATE vehiculos
+        SET n_incidencias = n_incidencias + 1,
+            estado = CASE WHEN n_incidencias + 1 >= 3 THEN 'BLOQUEADO' ELSE estado END
+        WHERE placa = $1 AND estado <> 'BLOQUEADO'
+        RETURNING placa, n_incidencias
+    ),
+    ins AS (
+        INSERT INTO incidencias (placa, id_empleado, latitud, longitud, descripcion)
+        SELECT placa, $2, $3, $4, 'Infracción registrada por app' FROM upd
+    )
+    SELECT n_incidencias FROM upd
+"""
+
+# Consultas de solo lectura que '_preparar_consultas' ejecuta al abrir cada
+# conexión para dejarlas ya en la caché (las que escriben se preparan en su
+# primer uso).
+CONSULTAS_PREPARADAS = (
+    SQL_LOGIN,
+    SQL_VEHICULO,
+    SQL_VEHICULO_REPORTE,
+    SQL_ID_EMPLEADO,
+)
+
+async def _preparar_consultas(conn):
+    """
+    Callback 'init' del pool. Se ejecuta una vez por cada conexión nueva
+    y corre cada consulta de CONSULTAS_PREPARADAS con un valor que no existe,
+    así quedan preparadas en la caché de asyncpg y ninguna petición paga el
+    costo de parsear y planear el SQL.
+    """
+    for sql in CONSULTAS_PREPARADAS:
+        await conn.fetchrow(sql, '')
+
+async def get_placa_limpia(placa: str):
+    """
+    Función de dependencia. Entrega el parámetro {placa} de la URL ya
+    limpio (ver normalizar_placa). Es 'async' para que FastAPI no la mande
+    a un hilo aparte, como hace con las dependencias normales.
+    """
+    return normalizar_placa(placa)
+
 async def get_db_pool(request: Request):
     """
     Función de dependencia. FastAPI la llamará en cada endpoint
@@ -83,22 +317,60 @@ async def startup_db_client():
     Crea el "pool" de conexiones a PostgreSQL. Un pool es más eficiente
     que crear una conexión nueva para cada petición.
     """
-    print("--- VERIFICANDO CONEXIÓN ---")
+    # Arranca el hilo que escribe los logs (ver '--- Logging ---')
+    _listener_logs.start()
+
+    log.info("--- VERIFICANDO CONEXIÓN ---")
     # Lee la URL de conexión desde el archivo .env
     db_url = os.environ.get("DATABASE_URL")
-    print(f"LEYENDO DATABASE_URL: {db_url}")
-    print("---------------------------")
+    log.info("LEYENDO DATABASE_URL: %s", db_url)
+    log.info("---------------------------")
+
+    # Pool de hilos dedicado a verificar contraseñas. argon2 y bcrypt liberan
+    # el GIL, así que varias verificaciones pueden correr en paralelo sin
+    # bloquear el event loop.
+    # Se limita al número de CPUs para que una ráfaga de logins no agote hilos.
+    app.state.bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    # Hash "falso" para verificar contra él cuando el empleado no existe.
+    # Así todo login tarda lo mismo y no se puede adivinar qué números de
+    # empleado existen midiendo el tiempo. Debe ser del mismo algoritmo y
+    # costo que la mayoría de los hashes de la BD: mientras dura la migración
+    # son bcrypt con costo 12 (ver más abajo, al cargar los empleados).
+    app.state.DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(12))
     
     if not db_url:
-        print("ERROR CRÍTICO: No se encontró DATABASE_URL en el archivo .env")
+        log.critical("ERROR CRÍTICO: No se encontró DATABASE_URL en el archivo .env")
         return
 
+    # Tamaño del pool configurable desde el .env (DB_POOL_MIN / DB_POOL_MAX).
+    # Se mantienen varias conexiones abiertas para que una ráfaga de
+    # peticiones no tenga que esperar a conectar; las que quedan inactivas
+    # 5 minutos se cierran, y ninguna consulta puede tardar más de 10 s.
     app.state.pool = await asyncpg.create_pool(
         db_url,
-        min_size=1,
-        max_size=10
+        min_size=int(os.getenv('DB_POOL_MIN', '5')),
+        max_size=int(os.getenv('DB_POOL_MAX', '40')),
+        max_inactive_connection_lifetime=300,
+        command_timeout=10,
+        statement_cache_size=2048,
+        init=_preparar_consultas
     )
-    print("Pool de conexiones a PostgreSQL creado.")
+    log.info("Pool de conexiones a PostgreSQL creado.")
+
+    # Los empleados (guardias) son pocos y casi no cambian: se cargan una vez
+    # {numero_empleado: id_empleado} para que /reportar no tenga que
+    # consultarlos en cada petición (ver _obtener_id_empleado).
+    async with app.state.pool.acquire() as conn:
+        filas = await conn.fetch(SQL_IDS_EMPLEADOS)
+        mayoria_argon2 = await conn.fetchval(SQL_MAYORIA_ARGON2)
+    app.state.empleado_ids = {f['numero_empleado']: f['id_empleado'] for f in filas}
+    log.info("%s empleados cargados en memoria.", len(app.state.empleado_ids))
+
+    # Cuando la mayoría de los empleados ya tenga hash argon2, el hash falso
+    # también debe serlo (si no, los IDs inexistentes tardarían distinto)
+    if mayoria_argon2:
+        app.state.DUMMY_HASH = password_hasher.hash(b"x").encode('utf-8')
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
@@ -108,115 +380,182 @@ async def shutdown_db_client():
     """
     if hasattr(app.state, 'pool'):
         await app.state.pool.close()
-        print("Pool de conexiones cerrado.")
+        log.info("Pool de conexiones cerrado.")
+    if hasattr(app.state, 'bcrypt_pool'):
+        app.state.bcrypt_pool.shutdown(wait=False)
+    # Escribe los mensajes que queden en la cola y detiene el hilo de logs
+    _listener_logs.stop()
 
 
 # --- 6. Endpoints (Rutas de la API) ---
 
+# La respuesta de "/" nunca cambia: se convierte a JSON una sola vez al
+# arrancar y se devuelve el mismo objeto en cada petición (los monitores de
+# "uptime" la consultan seguido).
+_RESPUESTA_ROOT = Response(
+    MensajeResponse(mensaje="Servidor SIVC del Tec Culiacán está en línea.").model_dump_json(),
+    media_type="application/json"
+)
+
 @app.get("/")
 async def root():
     """Ruta raíz de bienvenida. Útil para probar si el servidor está en línea."""
-    return {"mensaje": "Servidor SIVC del Tec Culiacán está en línea."}
+    return _RESPUESTA_ROOT
 
-@app.post("/login")
+async def _autenticar(pool, numero_empleado: str, password_bytes: bytes):
+    """
+    Busca al empleado y verifica su contraseña.
+    Devuelve (empleado, password_valida); 'empleado' es None si no existe.
+    """
+    async with pool.acquire() as conn:
+        # Busca al empleado por su ID único
+        empleado = await conn.fetchrow(SQL_LOGIN, numero_empleado)
+
+    # --- Verificación de Contraseña (argon2 / bcrypt) ---
+    # 1. La contraseña de Flutter ya llega en bytes (ver LoginRequest)
+    # 2. El hash de la BD ya llega en bytes (ver SQL_LOGIN).
+    #    Si el empleado no existe, se usa el hash falso: la verificación corre
+    #    igual y la respuesta tarda lo mismo que con un empleado real.
+    if empleado is not None:
+        hash_bytes = empleado['password_hash_bytes']
+    else:
+        hash_bytes = app.state.DUMMY_HASH
+
+    # 3. Se comparan contraseña y hash. Es la única forma segura.
+    #    Se ejecuta en el pool de hilos porque tarda decenas de ms de CPU
+    #    y, si corriera aquí, bloquearía a todas las demás peticiones.
+    #    (La conexión a la BD ya se devolvió al pool antes de este paso.)
+    loop = asyncio.get_running_loop()
+    password_valida = await loop.run_in_executor(
+        app.state.bcrypt_pool, verificar_password, password_bytes, hash_bytes
+    )
+    return empleado, password_valida
+
+# Logins que se están verificando ahora mismo:
+# numero_empleado -> (password, tarea de _autenticar)
+_logins_en_curso: dict[str, tuple[bytes, asyncio.Task]] = {}
+
+async def _autenticar_una_vez(pool, numero_empleado: str, password_bytes: bytes):
+    """
+    Igual que _autenticar, pero si ya hay un login en curso con el mismo
+    empleado y la misma contraseña (ej: la app reenvió la petición), espera
+    ese resultado en lugar de verificar la contraseña otra vez.
+    """
+    en_curso = _logins_en_curso.get(numero_empleado)
+    # compare_digest: compara en tiempo constante para no filtrar la contraseña
+    if en_curso is not None and hmac.compare_digest(en_curso[0], password_bytes):
+        # shield: si este cliente se desconecta, la tarea sigue para los demás
+        return await asyncio.shield(en_curso[1])
+
+    tarea = asyncio.ensure_future(_autenticar(pool, numero_empleado, password_bytes))
+    if en_curso is None:
+        _logins_en_curso[numero_empleado] = (password_bytes, tarea)
+        tarea.add_done_callback(lambda _: _logins_en_curso.pop(numero_empleado, None))
+    return await asyncio.shield(tarea)
+
+@app.post("/login", response_model=LoginResponse)
 async def login(login_request: LoginRequest, pool = Depends(get_db_pool)):
     """
     Endpoint para autenticar a un empleado (guardia).
     Recibe el 'numero_empleado' y 'password' en texto plano.
     """
-    async with pool.acquire() as conn:
-        # Busca al empleado por su ID único
-        empleado = await conn.fetchrow(
-            "SELECT * FROM empleados WHERE numero_empleado = $1",
-            login_request.numero_empleado
-        )
-
-        if not empleado:
-            # Si no existe, devuelve 404
-            raise HTTPException(status_code=404, detail="ID de Empleado no encontrado.")
-
-        # --- Verificación de Contraseña (bcrypt) ---
-        # 1. Convierte la contraseña de Flutter (str) a bytes (utf-8)
-        password_bytes = login_request.password.encode('utf-8')
-        
-        # 2. Convierte el hash de la BD (str) a bytes (utf-8)
-        hash_bytes = empleado['password_hash'].encode('utf-8')
-        
-        # 3. bcrypt compara los dos hashes. Es la única forma segura.
-        password_valida = bcrypt.checkpw(password_bytes, hash_bytes)
-        
-        # Imprime el resultado en la consola del servidor (para depuración)
-        print(f"--- COMPROBANDO LOGIN: {password_valida} ---")
-
-        if not password_valida:
-            # Si bcrypt dice 'False', devuelve 401
-            raise HTTPException(status_code=401, detail="Contraseña incorrecta.")
-
-        # Si todo es correcto, devuelve 200 OK con los datos del empleado
-        return {
-            "mensaje": "Login exitoso",
-            "nombre": empleado['nombre_completo'],
-            "numero_empleado": empleado['numero_empleado']
-        }
+    empleado, password_valida = await _autenticar_una_vez(
+        pool, login_request.numero_empleado, login_request.password
+    )
+
+    # Imprime el resultado en la consola del servidor (para depuración)
+    log.info("--- COMPROBANDO LOGIN: %s ---", password_valida)
+
+    if not (empleado is not None and password_valida):
+        # Empleado inexistente o contraseña incorrecta: mismo 401 genérico
+        # para no revelar cuál de los dos falló
+        raise HTTPException(status_code=401, detail="ID de Empleado o contraseña incorrectos.")
+
+    # Si todo es correcto, devuelve 200 OK con los datos del empleado
+    return {
+        "mensaje": "Login exitoso",
+        "nombre": empleado['nombre_completo'],
+        "numero_empleado": empleado['numero_empleado']
+    }
+
+async def _buscar_vehiculo(conn, placa: str, placa_limpia: str):
+    """
+    Busca en la BD el vehículo, su conductor, su estado y su número de
+    faltas actual. Devuelve (vehiculo, conteo).
+    Lanza 404 si la placa no existe o no tiene conductor asignado.
+    """
+    # --- CONSULTA SQL ROBUSTA ---
+    # Esta consulta busca la placa del conductor:
+    # 1. JOIN: Une 'vehiculos' (v) con 'conductores' (c).
+    # 2. WHERE: Compara la columna 'placa_norm' (la placa de la BD ya
+    #    limpia, ver migraciones/001_placa_norm.sql) con la placa limpia
+    #    que envía la app. Al estar indexada, no se recorre toda la tabla.
+    conductor_data = await conn.fetchrow(SQL_VEHICULO, placa_limpia)
+
+    if not conductor_data:
+        # Si la consulta (con el JOIN) no devuelve filas, es 404.
+        log.warning("ALERTA 404: No se encontró la placa '%s' en la BD o no tiene conductor asignado.", placa)
+        raise HTTPException(status_code=404, detail=f"Placa '{placa}' no registrada o sin conductor asignado.")
+
+    log.info("PLACA ENCONTRADA: %s (Conductor: %s)", conductor_data['placa'], conductor_data['nombre_completo'])
+
+    vehiculo = {
+        "placa": conductor_data['placa'],
+        "modelo": conductor_data['modelo'],
+        "estado": conductor_data['estado'],
+        "nombre_conductor": conductor_data['nombre_completo'],
+    }
+    return vehiculo, conductor_data['n_incidencias']
+
 
 # --- ENDPOINT DE CONSULTA (PASO 1) ---
-@app.get("/vehiculo/{placa}")
-async def get_info_vehiculo(placa: str, pool = Depends(get_db_pool)):
+@app.get("/vehiculo/{placa}", response_model=VehiculoResponse)
+async def get_info_vehiculo(
+    placa: str,
+    placa_limpia: str = Depends(get_placa_limpia),  # La placa de entrada se limpia igual que en la BD
+    pool = Depends(get_db_pool)
+):
     """
     Endpoint para SOLO CONSULTAR la información de una placa.
     No registra ninguna incidencia. Cumple la regla de "primero identificar".
     La 'placa' llega como un parámetro en la URL (ej: /vehiculo/VJM131C)
     """
-    print(f"--- CONSULTANDO PLACA (GET): {placa} ---")
+    log.info("--- CONSULTANDO PLACA (GET): %s ---", placa)
     async with pool.acquire() as conn:
-        
-        # --- CONSULTA SQL ROBUSTA ---
-        # Esta consulta busca la placa del conductor:
-        # 1. JOIN: Une 'vehiculos' (v) con 'conductores' (c).
-        # 2. WHERE: Limpia la placa de la BD (TRIM, REPLACE, UPPER) y la
-        #    compara con la placa limpia (en mayúsculas) que envía la app.
-        # Esta es la consulta que probamos en pgAdmin y SÍ FUNCIONA.
-        conductor_data = await conn.fetchrow(
-            """
-            SELECT v.placa, v.modelo, v.estado, c.nombre_completo
-            FROM vehiculos v 
-            JOIN conductores c ON v.id_conductor = c.id_conductor
-            WHERE TRIM(UPPER(REPLACE(REPLACE(v.placa, '-', ''), ' ', ''))) = $1
-            """, 
-            placa.upper() # Aseguramos que la placa de entrada también esté en mayúsculas
-        )
-        
-        if not conductor_data:
-            # Si la consulta (con el JOIN) no devuelve filas, es 404.
-            print(f"ALERTA 404: No se encontró la placa '{placa}' en la BD o no tiene conductor asignado.")
-            raise HTTPException(status_code=404, detail=f"Placa '{placa}' no registrada o sin conductor asignado.")
-        
-        print(f"PLACA ENCONTRADA: {conductor_data['placa']} (Conductor: {conductor_data['nombre_completo']})")
-        
-        # Busca cuántas faltas tiene ya registradas
-        conteo = await conn.fetchval(
-            "SELECT COUNT(*) FROM incidencias WHERE placa = $1",
-            conductor_data['placa'] # Usamos la placa real de la BD (con guiones/espacios)
-        )
-
-        # Devuelve el JSON con toda la info a la app Flutter
+        # El JOIN ya trae el contador de faltas y el estado: una sola consulta
+        vehiculo, conteo = await _buscar_vehiculo(conn, placa, placa_limpia)
+
+        # Devuelve el JSON con toda la info a la app Flutter, más el token
+        # que la app debe mandar de regreso en /reportar
         return {
-            "placa": conductor_data['placa'],
-            "modelo": conductor_data['modelo'],
-            "estado": conductor_data['estado'],
-            "nombre_conductor": conductor_data['nombre_completo'],
-            "faltas_actuales": conteo
+            **vehiculo,
+            "faltas_actuales": conteo,
+            "token": crear_token_vehiculo(vehiculo, placa_limpia)
         }
 
 
+async def _obtener_id_empleado(conn, numero_empleado: str):
+    """
+    Devuelve el ID numérico (PK) del empleado desde 'app.state.empleado_ids'.
+    Si no está (ej: empleado dado de alta después de arrancar), lo busca en
+    la BD y lo agrega. Devuelve None si el empleado no existe.
+    """
+    id_empleado = app.state.empleado_ids.get(numero_empleado)
+    if id_empleado is None:
+        id_empleado = await conn.fetchval(SQL_ID_EMPLEADO, numero_empleado)
+        if id_empleado is not None:
+            app.state.empleado_ids[numero_empleado] = id_empleado
+    return id_empleado
+
+
 # --- ENDPOINT DE REPORTE (PASO 2) ---
-@app.post("/reportar")
+@app.post("/reportar", response_model=MensajeResponse)
 async def reportar_incidencia(incidencia: IncidenciaRequest, pool = Depends(get_db_pool)):
     """
     Endpoint para REGISTRAR una nueva incidencia y aplicar la lógica de negocio (3 Faltas).
     Se ejecuta cuando el guardia presiona "Confirmar Falta".
     """
-    print(f"--- REPORTANDO PLACA (POST): {incidencia.placa} ---")
+    log.info("--- REPORTANDO PLACA (POST): %s ---", incidencia.placa)
     
     # 'async with conn.transaction()' es crucial.
     # Si algo falla (ej: el UPDATE), toda la operación (el INSERT)
@@ -224,63 +563,59 @@ async def reportar_incidencia(incidencia: IncidenciaRequest, pool = Depends(get_
     async with pool.acquire() as conn:
         async with conn.transaction():
             try:
-                # 1. Volvemos a buscar/validar al conductor (usando la misma consulta robusta)
-                conductor_data = await conn.fetchrow(
-                    """
-                    SELECT v.placa, v.estado, c.nombre_completo, c.telefono
-                    FROM vehiculos v 
-                    JOIN conductores c ON v.id_conductor = c.id_conductor
-                    WHERE TRIM(UPPER(REPLACE(REPLACE(v.placa, '-', ''), ' ', ''))) = $1
-                    """, 
-                    incidencia.placa.upper()
-                )
+                # 1. Datos del conductor: si la app mandó un token válido de
+                #    /vehiculo, se usan tal cual (sin consultar la BD)
+                datos_token = leer_token_vehiculo(incidencia.token, incidencia.placa)
+                if datos_token is not None:
+                    placa_real_db = datos_token['placa']
+                    nombre_conductor = datos_token['nombre_conductor']
+                    estado = datos_token['estado']
+                else:
+                    # Sin token: volvemos a buscar/validar al conductor (usando la misma
+                    # consulta robusta)
+                    conductor_data = await conn.fetchrow(
+                        SQL_VEHICULO_REPORTE,
+                        incidencia.placa  # Ya viene limpia (ver IncidenciaRequest)
+                    )
 
-                if not conductor_data:
-                    # Este chequeo es por seguridad, aunque la app ya lo hizo
-                    raise HTTPException(status_code=404, detail=f"Placa '{incidencia.placa}' no registrada.")
+                    if not conductor_data:
+                        # Este chequeo es por seguridad, aunque la app ya lo hizo
+                        raise HTTPException(status_code=404, detail=f"Placa '{incidencia.placa}' no registrada.")
 
-                # De aquí en adelante, usamos la placa REAL de la BD (con guiones, ej: VJM131C)
-                placa_real_db = conductor_data['placa']
-                nombre_conductor = conductor_data['nombre_completo']
+                    # De aquí en adelante, usamos la placa REAL de la BD (con guiones, ej: VJM131C)
+                    placa_real_db = conductor_data['placa']
+                    nombre_conductor = conductor_data['nombre_completo']
+                    estado = conductor_data['estado']
 
-                # 2. REGLA: Verificar estado de bloqueo
-                if conductor_data['estado'] == 'BLOQUEADO':
+                # 2. REGLA: Verificar estado de bloqueo (el paso 4 lo vuelve a
+                #    comprobar en la BD, por si el estado del token ya es viejo)
+                if estado == 'BLOQUEADO':
                     return {"mensaje": f"ACCESO DENEGADO. El vehículo de {nombre_conductor} ya se encuentra BLOQUEADO."}
 
-                # 3. Obtener el ID numérico (PK) del empleado
-                id_empleado_db = await conn.fetchval(
-                    "SELECT id_empleado FROM empleados WHERE numero_empleado = $1",
-                    incidencia.id_empleado
-                )
+                # 3. Obtener y validar el ID numérico (PK) del empleado
+                id_empleado_db = await _obtener_id_empleado(conn, incidencia.id_empleado)
                 if not id_empleado_db:
                     raise HTTPException(status_code=404, detail="ID de Empleado no válido.")
 
-                # 4. REGLA: Registrar la nueva incidencia
-                await conn.execute(
-                    """
-                    INSERT INTO incidencias (placa, id_empleado, latitud, longitud, descripcion)
-                    VALUES ($1, $2, $3, $4, 'Infracción registrada por app')
-                    """,
+                # 4. REGLA: Registrar la nueva incidencia y contar el total
+                #    (incluye la que acabamos de registrar). Si llega a 3,
+                #    la misma sentencia bloquea el vehículo.
+                conteo = await conn.fetchval(
+                    SQL_REGISTRAR_INCIDENCIA,
                     placa_real_db,
                     id_empleado_db,
                     incidencia.latitud,
                     incidencia.longitud
                 )
 
-                # 5. Contar el total de incidencias (ahora incluye la que acabamos de registrar)
-                conteo = await conn.fetchval(
-                    "SELECT COUNT(*) FROM incidencias WHERE placa = $1",
-                    placa_real_db
-                )
+                if conteo is None:
+                    # La BD dice que el vehículo ya estaba BLOQUEADO: no se registró nada
+                    return {"mensaje": f"ACCESO DENEGADO. El vehículo de {nombre_conductor} ya se encuentra BLOQUEADO."}
 
-                # 6. Aplicar la Lógica de Negocio (Tus reglas)
+                # 5. Aplicar la Lógica de Negocio (Tus reglas)
                 
-                # REGLA: 3ra incidencia = BLOQUEO
+                # REGLA: 3ra incidencia = BLOQUEO (ya aplicado en la BD)
                 if conteo >= 3:
-                    await conn.execute(
-                        "UPDATE vehiculos SET estado = 'BLOQUEADO' WHERE placa = $1",
-                        placa_real_db
-                    )
                     return {
                         "mensaje": f"¡BLOQUEO Y NOTIFICACIÓN! El vehículo de {nombre_conductor} tiene {conteo} faltas. Acceso Denegado."
                     }
@@ -297,11 +632,33 @@ async def reportar_incidencia(incidencia: IncidenciaRequest, pool = Depends(get_
                         "mensaje": f"ADVERTENCIA: Falta #{conteo} registrada para {nombre_conductor}. Próxima falta resultará en bloqueo."
                     }
             
+            except HTTPException:
+                # Los 404 de arriba se devuelven tal cual (no son un error 500)
+                raise
             except Exception as e:
                 # Si algo falla (ej: error SQL), la transacción hace "rollback"
-                print(f"\n--- ERROR INTERNO DEL SERVIDOR (POSTGRESQL) ---\n{str(e)}\n----------------------------------------\n")
+                log.error("\n--- ERROR INTERNO DEL SERVIDOR (POSTGRESQL) ---\n%s\n----------------------------------------\n", e)
                 raise HTTPException(status_code=500, detail=f"Error interno al procesar el reporte: {str(e)}")
 
 # --- Comando para ejecutar el servidor ---
 # En la terminal, dentro de D:\ReconocimientoPlacas\backend y con el .venv activo:
-# uvicorn main:app --reload --host 0.0.0.0 --port 8000
\ No newline at end of file
+# uvicorn main:app --reload --host 0.0.0.0 --port 8000
+#
+# En producción (Linux), con el event loop uvloop y el parser HTTP httptools
+# (ambos en C, vienen con uvicorn[standard]) y un proceso por núcleo:
+# uvicorn main:app --loop uvloop --http httptools --workers $(nproc) --host 0.0.0.0 --port 8000
+# Con varios procesos, TOKEN_SECRET debe estar en el .env (ver crear_token_vehiculo).
+#
+# También se puede arrancar con: python main.py
+if __name__ == "__main__":
+    import uvicorn
+
+    # loop="uvloop" ya instala uvloop (no existe en Windows: ahí usa el
+    # comando 'uvicorn' de arriba)
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools"
+    )
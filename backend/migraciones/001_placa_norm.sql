@@ -0,0 +1,15 @@
+-- Migración 001: columna de placa normalizada + índice
+--
+-- Antes, las búsquedas por placa limpiaban la columna en cada fila
+-- (TRIM/UPPER/REPLACE), lo que obligaba a PostgreSQL a recorrer toda la
+-- tabla 'vehiculos'. Con esta columna generada la placa limpia se calcula
+-- una sola vez al escribir la fila y la búsqueda usa el índice.
+--
+-- Ejecutar una sola vez (ej: desde pgAdmin o con psql):
+--   psql "$DATABASE_URL" -f migraciones/001_placa_norm.sql
+
+ALTER TABLE vehiculos
+    ADD COLUMN IF NOT EXISTS placa_norm text
+    GENERATED ALWAYS AS (upper(regexp_replace(placa, '[- ]', '', 'g'))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_vehiculos_placa_norm ON vehiculos (placa_norm);
@@ -0,0 +1,18 @@
+-- Migración 002: contador de incidencias por vehículo + índice
+--
+-- /vehiculo y /reportar necesitaban un COUNT(*) sobre 'incidencias' en
+-- cada petición. Ahora cada vehículo guarda su número de faltas en
+-- 'n_incidencias', que /reportar incrementa en la misma sentencia del
+-- INSERT; leerlo es tomar una columna de una sola fila.
+--
+-- Ejecutar una sola vez, después de 001_placa_norm.sql:
+--   psql "$DATABASE_URL" -f migraciones/002_n_incidencias.sql
+
+CREATE INDEX IF NOT EXISTS idx_incidencias_placa ON incidencias (placa);
+
+ALTER TABLE vehiculos
+    ADD COLUMN IF NOT EXISTS n_incidencias int NOT NULL DEFAULT 0;
+
+-- Carga inicial con las faltas que ya estaban registradas
+UPDATE vehiculos v
+SET n_incidencias = (SELECT COUNT(*) FROM incidencias i WHERE i.placa = v.placa);